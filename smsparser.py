@@ -47,10 +47,83 @@ Label
     - parent, path
 '''
 
+import os
 import re
 import json
-import copy
-import pyparsing as pp
+import itertools
+import sys
+import collections
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# splits a whitespace separated trigger token into opening parenthesis,
+# operand and closing parenthesis groups
+_TRIGGER_TOKEN_RE = re.compile(r'(\(*)([\w\d./=!]*)(\)*)')
+
+# trigger operands that are not node paths
+_STATUS_WORDS = frozenset(('complete', 'unknown'))
+_LOGIC_WORDS = frozenset(('AND', 'OR', 'NOT'))
+_EQ_WORDS = frozenset(('==', '!='))
+
+# trigger expression -> (template, node paths), see _split_trigger()
+_TRIGGER_CACHE = {}
+
+# trigger template -> compiled function, see _trigger_function()
+_TRIGGER_FUNCTIONS = {}
+
+# trigger template -> definition file syntax, see _trigger_definition()
+_TRIGGER_DEFINITIONS = {}
+_TEMPLATE_TOKEN_RE = re.compile(r'\(|\)|"[^"]*"|[^\s()"]+')
+
+def _task_json(obj):
+    return {
+        'sms_type' : obj.sms_type,
+        'name' : obj.name,
+        'variables' : obj.variables,
+        'labels' : obj.labels,
+        'meters' : obj.meters,
+    }
+
+def _family_json(obj):
+    return {
+        'sms_type' : obj.sms_type,
+        'name' : obj.name,
+        'variables' : obj.variables,
+        'tasks' : obj.tasks,
+        'families' : obj.families,
+    }
+
+def _suite_json(obj):
+    return {
+        'sms_type' : obj.sms_type,
+        'name' : obj.name,
+        'variables' : obj.variables,
+        'families' : obj.families,
+    }
+
+def _label_json(obj):
+    return {
+        'sms_type' : obj.sms_type,
+        'name' : obj.name,
+        'text' : obj.text,
+    }
+
+def _meter_json(obj):
+    return {
+        'sms_type' : obj.sms_type,
+        'name' : obj.name,
+        'minimum' : obj.minimum,
+        'maximum' : obj.maximum,
+        'mark' : obj.mark,
+    }
+
+# class -> function building its JSON representation, filled in once the
+# classes are defined at the end of the module. Subclasses are added the
+# first time they are serialized.
+_SERIALIZERS = {}
 
 # TODO
 # add the remaining SMS elements (trigger)
@@ -59,90 +132,380 @@ def to_json(obj):
     Serialize the SMS element classes to JSON.
     '''
 
-    if isinstance(obj, Task):
-        result = {
-            'sms_type' : obj.sms_type,
-            'name' : obj.name,
-            'variables' : obj.variables,
-            'labels' : obj.labels,
-            'meters' : obj.meters,
-        }
-    elif isinstance(obj, Family):
-        result = {
-            'sms_type' : obj.sms_type,
-            'name' : obj.name,
-            'variables' : obj.variables,
-            'tasks' : obj.tasks,
-            'families' : obj.families,
-        }
-    elif isinstance(obj, Suite):
-        result = {
-            'sms_type' : obj.sms_type,
-            'name' : obj.name,
-            'variables' : obj.variables,
-            'families' : obj.families,
-        }
-    elif isinstance(obj, Label):
-        result = {
-            'sms_type' : obj.sms_type,
-            'name' : obj.name,
-            'text' : obj.text,
-        }
-    elif isinstance(obj, Meter):
-        result = {
-            'sms_type' : obj.sms_type,
-            'name' : obj.name,
-            'minimum' : obj.minimum,
-            'maximum' : obj.maximum,
-            'mark' : obj.mark,
-        }
-    else:
-        raise TypeError(repr(obj) + 'is not JSON serializable')
-    return result
+    try:
+        serializer = _SERIALIZERS[type(obj)]
+    except KeyError:
+        for cls in type(obj).__mro__:
+            if cls in _SERIALIZERS:
+                serializer = _SERIALIZERS[type(obj)] = _SERIALIZERS[cls]
+                break
+        else:
+            raise TypeError(repr(obj) + 'is not JSON serializable')
+    return serializer(obj)
 
 def sms_grammar():
-    quote = pp.Word('"\'', exact=1).suppress()
+    # pyparsing is only needed for files that fast_parse_file() can not
+    # handle, so it is not imported until a grammar is actually built
+    import pyparsing as pp
+
+    # The alternatives below are picked by their leading keyword, so there is
+    # little backtracking for packrat memoization to save and its cache
+    # bookkeeping makes parsing slower. Set SMS_PACKRAT=1 in the environment
+    # to enable it anyway.
+    if os.environ.get('SMS_PACKRAT', '0') == '1':
+        pp.ParserElement.enable_packrat(cache_size_limit=128)
+
     colon = pp.Literal(':').suppress()
-    l_paren = pp.Literal('(').suppress()
-    r_paren = pp.Literal(')').suppress()
-    sms_node_path = pp.Word('./_' + pp.alphanums)
-    identifier = pp.Word(pp.alphas, pp.alphanums + '_')
-    var_value = pp.Word(pp.alphanums) | (quote + \
-            pp.Combine(pp.OneOrMore(pp.Word(pp.alphanums)), adjacent=False, 
-                       joinString=' ') + quote)
+    sms_node_path = pp.Regex(r'[./_A-Za-z0-9]+')
+    identifier = pp.Regex(r'[A-Za-z][A-Za-z0-9_]*')
+    # a quoted value is one or more words, joined by single spaces
+    quoted_value = pp.Regex(r'["\'][ \t\r\n]*[A-Za-z0-9]+'
+                            r'(?:[ \t\r\n]+[A-Za-z0-9]+)*[ \t\r\n]*["\']')
+    quoted_value.set_parse_action(lambda t: ' '.join(t[0][1:-1].split()))
+    var_value = pp.Regex(r'[A-Za-z0-9]+') | quoted_value
     sms_var = pp.Group(pp.Keyword('edit') + identifier + var_value)
+    sms_var.set_name('edit')
     sms_label = pp.Group(pp.Keyword('label') + identifier + var_value)
+    sms_label.set_name('label')
     sms_meter = pp.Group(pp.Keyword('meter') + identifier + pp.Word(pp.nums) * 3)
+    sms_meter.set_name('meter')
     sms_limit = pp.Group(pp.Keyword('limit') + identifier + pp.Word(pp.nums))
+    sms_limit.set_name('limit')
     sms_in_limit = pp.Group(pp.Keyword('inlimit') + sms_node_path + colon + identifier)
-    sms_trigger = pp.Group(pp.Keyword('trigger') + pp.restOfLine)
+    sms_in_limit.set_name('inlimit')
+    sms_trigger = pp.Group(pp.Keyword('trigger') + pp.rest_of_line)
+    sms_trigger.set_name('trigger')
+    # the alternatives all start with a distinct keyword, so their order does
+    # not change the result; the most frequent ones go first so that fewer
+    # keywords are tried before one matches
     sms_task = pp.Group(
         pp.Keyword('task') + \
         identifier + \
         pp.ZeroOrMore(
-            sms_trigger ^ sms_in_limit ^ sms_label ^ sms_meter ^ sms_var
+            sms_var | sms_trigger | sms_label | sms_meter | sms_in_limit
         )
     ) + pp.Optional(pp.Keyword('endtask').suppress())
+    sms_task.set_name('task')
     sms_family = pp.Forward()
+    sms_family.set_name('family')
     sms_family << pp.Group(
         pp.Keyword('family') + identifier + pp.ZeroOrMore(
-            sms_in_limit ^ sms_limit ^ sms_trigger ^ sms_var ^ sms_task ^ sms_family
+            sms_var | sms_task | sms_trigger | sms_in_limit | sms_limit | \
+            sms_family
         )
     ) + pp.Keyword('endfamily').suppress()
     sms_suite = pp.Keyword('suite') + identifier + \
-                pp.ZeroOrMore(sms_var ^ sms_family) + \
+                pp.ZeroOrMore(sms_var | sms_family) + \
                 pp.Keyword('endsuite').suppress()
     return sms_suite
 
-class SMSNode(object):
+# Building blocks of the line-oriented scanner used by fast_parse_file(). They
+# mirror the tokens defined in sms_grammar().
+_IDENTIFIER = r'([A-Za-z][A-Za-z0-9_]*)'
+_NUMBER = r'([0-9]+)'
+_VALUE = r'(?:([A-Za-z0-9]+)|["\']([A-Za-z0-9]+(?:[ \t]+[A-Za-z0-9]+)*)["\'])'
+
+# pyparsing only skips these characters between tokens, so the scanner must
+# not treat any other whitespace (\f, \v, non-breaking spaces...) as such
+_BLANKS = ' \t\r\n'
+_SEPARATOR_RE = re.compile(r'[ \t]+')
+
+# regular expressions for the arguments that follow each keyword
+_ARGUMENT_RES = {
+    'suite': re.compile(_IDENTIFIER + '$'),
+    'family': re.compile(_IDENTIFIER + '$'),
+    'task': re.compile(_IDENTIFIER + '$'),
+    'edit': re.compile(r'%s[ \t]+%s$' % (_IDENTIFIER, _VALUE)),
+    'label': re.compile(r'%s[ \t]+%s$' % (_IDENTIFIER, _VALUE)),
+    'meter': re.compile(r'%s[ \t]+%s[ \t]+%s[ \t]+%s$' % (
+        _IDENTIFIER, _NUMBER, _NUMBER, _NUMBER)),
+    'limit': re.compile(r'%s[ \t]+%s$' % (_IDENTIFIER, _NUMBER)),
+    'inlimit': re.compile(r'([./_A-Za-z0-9]+)[ \t]*:[ \t]*%s$' %
+                          _IDENTIFIER),
+}
+
+# the keywords that may appear inside each kind of node
+_NODE_CONTENTS = {
+    'suite': frozenset(('edit', 'family')),
+    'family': frozenset(('inlimit', 'limit', 'trigger', 'edit', 'task',
+                         'family')),
+    'task': frozenset(('trigger', 'inlimit', 'label', 'meter', 'edit')),
+}
+
+# the kind of node closed by each end keyword
+_END_KEYWORDS = {
+    'endsuite': 'suite',
+    'endfamily': 'family',
+    'endtask': 'task',
+}
+
+def _scan_line(keyword, arguments):
+    '''
+    Return the parse group for a single line, or None if it is not valid.
+    '''
+
+    if keyword == 'trigger':
+        return [keyword, arguments]
+    re_obj = _ARGUMENT_RES[keyword].match(arguments)
+    if re_obj is None:
+        return None
+    group = [keyword]
+    if keyword in ('edit', 'label'):
+        name, word, words = re_obj.groups()
+        group += [name, word if word is not None else ' '.join(words.split())]
+    else:
+        group += re_obj.groups()
+    return group
+
+def fast_parse_file(def_file):
+    '''
+    Parse a definition file with a line-oriented scanner.
+
+    The result has the same layout as the one produced by sms_grammar(),
+    but the file is read one line at a time and each line is matched with a
+    single regular expression, which is much faster than pyparsing.
+
+    Only files with one statement per line are understood. None is returned
+    for anything else (including invalid files), and such files should be
+    parsed with the grammar instead.
+    '''
+
+    suite = None
+    stack = []
+    task_contents = _NODE_CONTENTS['task']
+    with open(def_file, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            # pyparsing reads the file as UTF-8 and expands tabs before
+            # parsing, which shows in the trigger text it keeps verbatim
+            line = line.expandtabs()
+            text = line.strip(_BLANKS)
+            if not text:
+                continue
+            tokens = _SEPARATOR_RE.split(text, 1)
+            keyword = tokens[0]
+            if keyword == 'trigger':
+                # kept verbatim, like the restOfLine used by the grammar
+                arguments = line.lstrip(_BLANKS)[len(keyword):].rstrip('\n')
+            else:
+                arguments = tokens[1] if len(tokens) > 1 else ''
+            if suite is None:
+                if keyword != 'suite':
+                    return None
+                suite = _scan_line(keyword, arguments)
+                if suite is None:
+                    return None
+                stack.append(suite)
+                continue
+            if not stack:
+                # there is something after endsuite
+                return None
+            node = stack[-1]
+            if node[0] == 'task' and keyword != 'endtask' and \
+                    keyword not in task_contents:
+                # endtask is optional
+                stack.pop()
+                node = stack[-1]
+            if keyword in _END_KEYWORDS:
+                if node[0] != _END_KEYWORDS[keyword] or arguments != '':
+                    return None
+                stack.pop()
+            elif keyword in _NODE_CONTENTS[node[0]]:
+                group = _scan_line(keyword, arguments)
+                if group is None:
+                    return None
+                node.append(group)
+                if keyword in _NODE_CONTENTS:
+                    stack.append(group)
+            else:
+                return None
+    if suite is None or stack:
+        return None
+    return suite
+
+
+# indentation prefixes for the cdp definitions, indexed by nesting level
+_TABS = tuple('\t' * i for i in range(64))
+
+
+def _tabs(level):
+    try:
+        return _TABS[level]
+    except IndexError:
+        return '\t' * level
+
+
+def _split_trigger(trigger_exp):
+    '''
+    Split a trigger expression into a python template and its node paths.
+
+    The template has a '"%s"' placeholder for each node path. Results are
+    cached by expression, since many nodes of a suite usually share the same
+    trigger. A ValueError is raised for tokens that are not made of
+    parenthesis around a single operand.
+    '''
+
+    try:
+        return _TRIGGER_CACHE[trigger_exp]
+    except KeyError:
+        pass
+    new_exp = ''
+    paths = []
+    for token in trigger_exp.split():
+        re_obj = _TRIGGER_TOKEN_RE.fullmatch(token)
+        if re_obj is None:
+            raise ValueError('invalid trigger expression: %r' % trigger_exp)
+        for i in re_obj.groups():
+            if i == '':
+                pass
+            elif ('(' in i) or (')' in i):
+                new_exp += i
+            elif i in _STATUS_WORDS:
+                new_exp += ' "%s" ' % i
+            elif i in _LOGIC_WORDS:
+                new_exp += ' %s ' % i.lower()
+            elif i in _EQ_WORDS:
+                new_exp += ' %s ' % i
+            else:
+                new_exp += ' "%s" '
+                paths.append(i)
+    _TRIGGER_CACHE[trigger_exp] = new_exp, paths
+    return new_exp, paths
+
+def _trigger_function(exp):
+    '''
+    Return a trigger template from _split_trigger() compiled to a function.
+
+    The '"%s"' placeholders of the template become the arguments n0, n1, ...
+    of the function, which is called with the status of each node. Functions
+    are cached by template, so nodes whose triggers only differ in the node
+    paths share a single function.
+    '''
+
+    try:
+        return _TRIGGER_FUNCTIONS[exp]
+    except KeyError:
+        pass
+    num_nodes = exp.count('"%s"')
+    names = ['n%i' % i for i in range(num_nodes)]
+    source = 'lambda %s: (%s)' % (
+        ', '.join(names), exp.replace('"%s"', '%s') % tuple(names))
+    function = _TRIGGER_FUNCTIONS[exp] = eval(source, {'__builtins__': {}})
+    return function
+
+def _trigger_definition(exp):
+    '''
+    Return a trigger template from _split_trigger() in definition syntax.
+
+    The result has a '%s' placeholder for each node path, and status words
+    and AND/OR/NOT written as in the definition files, so that the output
+    of cdp_definition() can be parsed again.
+    '''
+
+    try:
+        return _TRIGGER_DEFINITIONS[exp]
+    except KeyError:
+        pass
+    definition = ''
+    for token in _TEMPLATE_TOKEN_RE.findall(exp):
+        if token.startswith('"'):
+            token = token[1:-1]
+        elif token.upper() in _LOGIC_WORDS:
+            token = token.upper()
+        if definition and not definition.endswith('(') and token != ')':
+            definition += ' '
+        definition += token
+    _TRIGGER_DEFINITIONS[exp] = definition
+    return definition
+
+def _bucket(parse_obj):
+    '''
+    Group the statements of a parsed node by their keyword.
+
+    Returns a dictionary mapping each keyword ('edit', 'task', ...) to the
+    list of statements that start with it, in their original order.
+    '''
+
+    buckets = collections.defaultdict(list)
+    for statement in parse_obj[2:]:
+        buckets[statement[0]].append(statement)
+    return buckets
+
+class _ChildList(list):
+    '''
+    A list of child nodes that keeps its owner's name -> child dict current.
+
+    Appending only adds the new nodes to the dict. Any other change to the
+    list discards the dict, and the owner rebuilds it on the next lookup.
+    Every change also discards the path index of the owner's suite.
+    '''
+
+    __slots__ = ('_owner',)
+
+    def __init__(self, owner=None, nodes=()):
+        list.__init__(self, nodes)
+        self._owner = owner
+
+    def _added(self, nodes):
+        owner = getattr(self, '_owner', None)
+        if owner is not None:
+            if owner._children is not None:
+                for node in nodes:
+                    owner._children[node.name] = node
+            owner._invalidate_path_index()
+
+    def _changed(self):
+        owner = getattr(self, '_owner', None)
+        if owner is not None:
+            owner._children = None
+            owner._invalidate_path_index()
+
+    def append(self, node):
+        list.append(self, node)
+        self._added((node,))
+
+    def extend(self, nodes):
+        nodes = list(nodes)
+        list.extend(self, nodes)
+        self._added(nodes)
+
+    def insert(self, index, node):
+        list.insert(self, index, node)
+        self._added((node,))
+
+    def __iadd__(self, nodes):
+        self.extend(nodes)
+        return self
+
+    def remove(self, node):
+        list.remove(self, node)
+        self._changed()
+
+    def pop(self, index=-1):
+        node = list.pop(self, index)
+        self._changed()
+        return node
+
+    def clear(self):
+        list.clear(self)
+        self._changed()
 
-    _name = ''
-    _parent = None
-    _path = ''
-    _suite = None
-    variables = dict()
-    status = 'unknown'
-    sms_type = None
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._changed()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._changed()
+
+    def __imul__(self, times):
+        list.__imul__(self, times)
+        self._changed()
+        return self
+
+class SMSNode:
+
+    __slots__ = ('_name', '_parent', '_path', '_suite', '_children',
+                 'variables', 'status', 'sms_type')
 
     @property
     def name(self):
@@ -150,9 +513,16 @@ class SMSNode(object):
 
     @name.setter
     def name(self, name):
+        if self._name:
+            self._resolve_pending_triggers()
+        self._invalidate_path_index()
+        if self._parent is not None and self._parent._children is not None \
+                and self._parent._children.get(self._name) is self:
+            del self._parent._children[self._name]
+            self._parent._children[name] = self
         self._name = name
-        old_path_list = self._path.split('/')
-        self._path = '/'.join(old_path_list[:-1]) + '/' + self._name
+        self._path = self._path.rpartition('/')[0] + '/' + self._name
+        self._update_descendants()
 
     @property
     def path(self):
@@ -162,61 +532,163 @@ class SMSNode(object):
     def suite(self):
         return self._suite
 
+    @property
+    def _child_lists(self):
+        '''
+        The lists holding the families and tasks directly below this node.
+
+        Traversals extend from each list in turn, so no combined list has to
+        be built for every node visited.
+        '''
+
+        return ()
+
     @property
     def parent(self):
         return self._parent
 
     @parent.setter
     def parent(self, parent):
+        if self._name:
+            self._resolve_pending_triggers()
+        self._invalidate_path_index()
         self._parent = parent
+        self._update_location()
+        self._invalidate_path_index()
+        self._update_descendants()
+
+    def _update_descendants(self):
+        '''
+        Recompute the path and suite of every node below this one.
+
+        Only nodes that already have children, i.e. that are being renamed or
+        moved rather than built, have any work to do here. The labels and
+        meters of this node and of its descendants are updated too.
+        '''
+
+        self._update_extras()
+        to_visit = []
+        for children in self._child_lists:
+            to_visit += children
+        while to_visit:
+            node = to_visit.pop()
+            node._update_location()
+            node._update_extras()
+            for children in node._child_lists:
+                to_visit += children
+
+    def _update_extras(self):
+        '''
+        Recompute the paths of the labels and meters of this node.
+        '''
+
+        pass
+
+    def _update_location(self):
+        '''
+        Recompute the path and suite of this node from its parent.
+        '''
+
         if self._parent is None:
             self._path = self.name
+            self._suite = self if isinstance(self, Suite) else None
         else:
             if self._parent.path == '/':
                 self._path = self._parent.path + self.name
             else:
                 self._path = self._parent.path + '/' + self.name
-        self._suite = self.get_suite()
+            self._suite = self._parent._suite
+            if self._suite is not None:
+                self._suite._pending_triggers = True
+
+    def _invalidate_path_index(self):
+        if self._suite is not None:
+            self._suite._path_index = None
+
+    def _resolve_pending_triggers(self):
+        '''
+        Resolve the triggers of this node's suite that are still unparsed.
+
+        Triggers are resolved lazily against the paths the nodes have at that
+        time, so this is done before a named node of the suite is renamed,
+        moved or removed, while the paths in the trigger expressions are still
+        valid.
+        '''
+
+        suite = self._suite
+        if suite is None or not suite._pending_triggers:
+            return
+        suite._pending_triggers = False
+        for node in suite.filter_nodes():
+            if isinstance(node, NodeWithTriggers) and node._trigger is None:
+                node._parse_trigger()
 
     def __init__(self, parse_obj=None, parent=None):
-        self.sms_type = self.__class__.__name__.lower()
+        self._name = ''
+        self._parent = None
+        self._path = ''
+        self._suite = None
+        self._children = None
+        self.variables = {}
+        self.status = 'unknown'
+        self.sms_type = sys.intern(self.__class__.__name__.lower())
         self.parent = parent
         if parse_obj is not None:
+            buckets = _bucket(parse_obj)
             self.name = parse_obj[1]
-            self.variables = self._get_variables(parse_obj)
+            self.variables = self._get_variables(buckets['edit'])
+            self._parse_cdp(buckets)
+
+    def _parse_cdp(self, buckets):
+        '''
+        Build the node specific contents from the bucketed parse results.
+        '''
+
+        pass
 
     def cdp_definition(self, indent_order=0):
-        output = '%s%s %s\n' % ('\t'*indent_order, self.sms_type, self.name)
-        output += self._start_cdp_definition(indent_order)
-        output += self._specific_cdp_definition(indent_order+1)
-        output += self._end_cdp_definition(indent_order)
-        return output
-
-    def _start_cdp_definition(self, indent_order=0):
-        output = ''
-        for k, v in self.variables.iteritems():
-            output += '%sedit %s "%s"\n' % ('\t'*(indent_order+1), k, v)
-        return output
-
-    def _end_cdp_definition(self, indent_order=0):
-        output = '%send%s\n' % ('\t'*indent_order, self.sms_type)
-        return output
-
-    def _specific_cdp_definition(self, indent_order=0):
-        return ''
-
-    def _get_variables(self, parse_obj):
-        d = dict()
-        for v in [var for var in parse_obj if var[0] == 'edit']:
-            d[v[1]] = v[2]
-        return d
+        parts = []
+        self._cdp_definition(parts, indent_order)
+        return ''.join(parts)
+
+    def _cdp_definition(self, parts, indent_order=0):
+        '''
+        Append the lines of this node's definition to the parts list.
+
+        The whole tree is written into the same list, which is only joined
+        once by cdp_definition().
+        '''
+
+        parts.append('%s%s %s\n' % (_tabs(indent_order), self.sms_type,
+                                     self.name))
+        self._start_cdp_definition(parts, indent_order)
+        self._specific_cdp_definition(parts, indent_order+1)
+        self._end_cdp_definition(parts, indent_order)
+
+    def _start_cdp_definition(self, parts, indent_order=0):
+        pad = _tabs(indent_order+1)
+        for k, v in self.variables.items():
+            parts.append('%sedit %s "%s"\n' % (pad, k, v))
+
+    def _end_cdp_definition(self, parts, indent_order=0):
+        parts.append('%send%s\n' % (_tabs(indent_order), self.sms_type))
+
+    def _specific_cdp_definition(self, parts, indent_order=0):
+        pass
+
+    def _get_variables(self, edits):
+        return dict((v[1], v[2]) for v in edits)
 
     def get_suite(self):
-        if self._parent is None:
-            result = None
-        else:
-            result = self._parent.get_suite()
-        return result
+        '''
+        Return the suite this node belongs to, or None if it is detached.
+
+        The suite (as well as the path) is resolved by the parent setter,
+        which copies it from the new parent and hands it down to the
+        children, so this is a plain attribute read.
+        '''
+
+        return self._suite
 
     def get_node(self, path):
         '''
@@ -231,154 +703,270 @@ class SMSNode(object):
 
         if path.startswith('/'):
             base_node = self.get_suite()
-            node = base_node.get_node(path[1:])
+            node = base_node._indexed_node(path)
+            if node is None:
+                node = base_node.get_node(path[1:])
         else:
             base_node = self.parent
             if base_node is None:
                 base_node = self.get_suite()
-            path_list = path.split('/')
-            rel_path_list = []
-            for token in path_list:
-                if token == '..':
-                    base_node = base_node.parent
-                else:
-                    rel_path_list.append(token)
-            rel_path = '/'.join(rel_path_list)
+            segments = path.split('/')
+            rel_path = path
+            if '..' in segments:
+                rel_segments = []
+                for token in segments:
+                    if token == '..':
+                        base_node = base_node.parent
+                    else:
+                        rel_segments.append(token)
+                segments = rel_segments
+                rel_path = '/'.join(segments)
             node = None
             if base_node is not None:
-                node = base_node._node_from_path(rel_path)
+                suite = base_node.get_suite()
+                if suite is not None and rel_path not in ('', '.'):
+                    node = suite._indexed_node(
+                        base_node.path.rstrip('/') + '/' + rel_path)
+                if node is None:
+                    node = base_node._node_from_path(segments)
         return node
 
-    def to_json(self, indent=None):
-        return json.dumps(self, default=to_json, indent=indent)
+    def _node_from_path(self, segments):
+        '''
+        Return the descendant found by following path segments down from
+        this node.
+
+        Each segment is looked up in the name -> child dict of the current
+        node, so resolving a path costs one dict lookup per segment.
+        '''
+
+        node = self
+        for segment in segments:
+            if segment in ('', '.'):
+                continue
+            node = node._child_named(segment)
+            if node is None:
+                break
+        return node
+
+    def _child_named(self, name):
+        if self._children is None:
+            # rebuilt after the child lists were changed other than by
+            # appending; families take precedence over tasks of the same name
+            children = {}
+            for nodes in reversed(self._child_lists):
+                for node in nodes:
+                    children[node.name] = node
+            self._children = children
+        return self._children.get(name)
+
+    def to_json(self, indent=None, compact=False):
+        '''
+        Serialize this node and everything below it to JSON.
+
+        Inputs:
+
+            indent - passed on to json.dumps()
+            compact - when True, indent is ignored and the output has no
+                whitespace at all. orjson is used for this when it is
+                installed.
+        '''
+
+        if not compact:
+            return json.dumps(self, default=to_json, indent=indent)
+        if orjson is not None:
+            return orjson.dumps(self, default=to_json).decode('utf-8')
+        return json.dumps(self, default=to_json, separators=(',', ':'),
+                          ensure_ascii=False)
 
     def __repr__(self):
         return self.name
 
     # TODO - extend with more filtering options
     def filter_nodes(self, node_type=None, node_name=None):
+        '''
+        Return the descendants of this node that match all the given filters.
+
+        Nodes are returned in depth-first order, families before tasks.
+
+        Inputs:
+
+            node_type - the sms_type of the nodes ('family', 'task')
+            node_name - a regular expression to search for in the node names
+        '''
+
+        name_re = None
+        if node_name is not None:
+            name_re = re.compile(node_name)
         nodes = []
-        nodes_to_iter = []
-        if hasattr(self, 'families'): 
-            nodes_to_iter += self.families
-        if hasattr(self, 'tasks'): 
-            nodes_to_iter += self.tasks
-        for n in nodes_to_iter:
-            conditions = {
-                'node_type' : False,
-                'node_name' : False,
-            }
-            for c in conditions.keys():
-                value = eval(c)
-                if value is None:
-                    conditions[c] = True
-                else:
-                    if c == 'node_type' and n.sms_type == value:
-                        conditions[c] = True
-                    elif c == 'node_name' and re.search(value, n.name) is not None:
-                        conditions[c] = True
-            if False not in conditions.values():
+        to_visit = [self]
+        while to_visit:
+            n = to_visit.pop()
+            if n is not self and \
+                    (node_type is None or n.sms_type == node_type) and \
+                    (name_re is None or name_re.search(n.name) is not None):
                 nodes.append(n)
-            nodes += n.filter_nodes(node_type, node_name)
+            for children in reversed(n._child_lists):
+                to_visit += reversed(children)
         return nodes
 
-
 class Suite(SMSNode):
 
-    families = []
+    __slots__ = ('_families', 'grammar', 'parse_obj', '_path_index',
+                 '_pending_triggers')
+
+    _default_grammar = None
 
     def __init__(self, def_file, grammar=None):
-        if grammar is None:
-            grammar = sms_grammar()
+        self._families = _ChildList(self)
+        self._path_index = None
+        # whether nodes have been added since the triggers were last resolved
+        self._pending_triggers = False
         self.grammar = grammar
-        parse_obj = self._parse_file(def_file)
+        parse_obj = None
+        if grammar is None:
+            parse_obj = fast_parse_file(def_file)
+        if parse_obj is None:
+            if self.grammar is None:
+                self.grammar = self._get_default_grammar()
+            parse_obj = self._parse_file(def_file)
         self.parse_obj = parse_obj
-        super(Suite, self).__init__(parse_obj=parse_obj, parent=None)
-        self._path = '/'
-        self.families = [Family(f, parent=self) for f in parse_obj if f[0] == 'family']
-        for f in self.families:
-            f._parse_triggers()
+        super().__init__(parse_obj=parse_obj, parent=None)
+
+    @property
+    def path(self):
+        return '/'
+
+    @property
+    def families(self):
+        return self._families
+
+    @families.setter
+    def families(self, families):
+        self._families = _ChildList(self, families)
+        self._children = None
+        self._invalidate_path_index()
+
+    @property
+    def _child_lists(self):
+        return (self._families,)
+
+    def _parse_cdp(self, buckets):
+        self.families = [Family(f, parent=self) for f in buckets['family']]
+
+    @classmethod
+    def _get_default_grammar(cls):
+        '''
+        Return the default grammar, building it only on first use.
+
+        The grammar does not depend on the input, so a single instance is
+        shared by every Suite that does not provide its own.
+        '''
+
+        if Suite._default_grammar is None:
+            Suite._default_grammar = sms_grammar()
+        return Suite._default_grammar
 
     def _parse_file(self, def_file):
-        fh = open(def_file, 'r')
-        parse_obj = self.grammar.parseString(fh.read())
+        parse_obj = self.grammar.parse_file(def_file, parse_all=True)
         return parse_obj
 
-    def _specific_cdp_definition(self, indent_order=0):
-        output = ''
+    def _specific_cdp_definition(self, parts, indent_order=0):
         for n in self.families:
-            output += n.cdp_definition(indent_order)
-        return output
+            n._cdp_definition(parts, indent_order)
+
+    def add_family(self, family):
+        if self._child_named(family.name) is not family:
+            old_parent = family.parent
+            if old_parent is not None and \
+                    old_parent._child_named(family.name) is family:
+                old_parent.remove_family(family)
+            self.families.append(family)
+            family.parent = self
+
+    def remove_family(self, family):
+        family._resolve_pending_triggers()
+        self.families.remove(family)
+        family.parent = None
+
+    def _indexed_node(self, path):
+        '''
+        Return the node with the given absolute path, or None.
 
-    def _node_from_path(self, path):
-        if path == '' or path == '.':
-            node = self
-        else:
-            path_list = path.split('/')
-            node_list = self.families
-            possible_node = None
-            for n in node_list:
-                if n.name == path_list[0]:
-                    new_path = '/'.join(path_list[1:])
-                    possible_node = n._node_from_path(new_path)
-            node = possible_node
-        return node
+        Lookups go through a path -> node index that is built on first use
+        and discarded whenever a node of the suite is renamed or moved, or a
+        families or tasks list of the suite is changed.
+        '''
 
-    def get_suite(self):
-        return self
+        if self._path_index is None:
+            index = {}
+            to_visit = [self]
+            while to_visit:
+                node = to_visit.pop()
+                index[node.path] = node
+                for children in node._child_lists:
+                    to_visit += children
+            self._path_index = index
+        if path != '/':
+            path = path.rstrip('/')
+        return self._path_index.get(path)
 
 
 class NodeWithTriggers(SMSNode):
 
-    trigger = ('', [])
-    _trigger_exp = ''
+    __slots__ = ('_trigger', '_trigger_exp')
+
+    @property
+    def trigger(self):
+        '''
+        The (expression, nodes) tuple of the trigger.
+
+        The trigger expression is only parsed, and its nodes resolved, the
+        first time it is needed.
+        '''
+
+        if self._trigger is None:
+            self._parse_trigger()
+        return self._trigger
+
+    @trigger.setter
+    def trigger(self, trigger):
+        self._trigger = trigger
+
+    def __init__(self, parse_obj=None, parent=None):
+        self._trigger = None
+        self._trigger_exp = ''
+        super().__init__(parse_obj=parse_obj, parent=parent)
 
     def _parse_trigger(self):
+        new_exp, paths = _split_trigger(self._trigger_exp)
+        self.trigger = new_exp, [self.get_node(p) for p in paths]
 
-        new_exp = ''
-        nodes = []
-        path_obj = re.compile(r'(\(*)([\w\d./=]*)(\)*)')
-        for tok in self._trigger_exp.split():
-            re_obj = path_obj.search(tok)
-            for i in re_obj.groups():
-                if i == '':
-                    pass
-                elif ('(' in i) or (')' in i):
-                    new_exp += i
-                elif i in ('complete', 'unknown'):
-                    new_exp += ' "%s" ' % i
-                elif i in ('AND', 'OR'):
-                    new_exp += ' %s ' % i.lower()
-                elif i in ('==',):
-                    new_exp += ' %s ' % i
-                else:
-                    new_exp += ' "%s" '
-                    nodes.append(self.get_node(i))
-        self.trigger = new_exp, nodes
-
-    def evalute_trigger(self):
+    def evaluate_trigger(self):
         exp, nodes = self.trigger
         if exp == '':
             result = True
         else:
-            result = eval(exp % tuple([n.status for n in nodes]))
+            function = _trigger_function(exp)
+            result = function(*[n.status for n in nodes])
         return result
 
+    # misspelled name kept for backwards compatibility
+    evalute_trigger = evaluate_trigger
 
 class Task(NodeWithTriggers):
 
-    in_limits = []
-    meters = []
-    labels = []
+    __slots__ = ('in_limits', 'meters', 'labels')
 
     def __init__(self, parse_obj=None, parent=None, name=None, 
                  variables=None, trigger=None, meters=None):
         if parse_obj is None and name is None:
             raise Exception
         else:
-            super(Task, self).__init__(parse_obj=parse_obj, parent=parent)
-            if parse_obj is not None:
-                self._parse_cdp(parse_obj)
+            self.in_limits = []
+            self.meters = []
+            self.labels = []
+            super().__init__(parse_obj=parse_obj, parent=parent)
             if name is not None:
                 self.name = name
             if variables is not None:
@@ -388,13 +976,15 @@ class Task(NodeWithTriggers):
             if meters is not None:
                 self.meters = meters
 
-    def _parse_cdp(self, parse_obj):
-        self.meters = [Meter(m[1], m[2], m[3], m[4], self) for m in parse_obj if m[0] == 'meter']
-        self.labels = [Label(la[1], la[2], self) for la in parse_obj if la[0] == 'label']
-        try:
-            self._trigger_exp = [t[1] for t in parse_obj if t[0] == 'trigger'][0]
-        except IndexError:
-            pass
+    def _parse_cdp(self, buckets):
+        self.meters = [Meter(m[1], m[2], m[3], m[4], self) for m in buckets['meter']]
+        self.labels = [Label(la[1], la[2], self) for la in buckets['label']]
+        if buckets['trigger']:
+            self._trigger_exp = buckets['trigger'][0][1]
+
+    def _update_extras(self):
+        for extra in itertools.chain(self.labels, self.meters):
+            extra.parent = self
 
     def add_label(self, label):
         if label not in self.labels:
@@ -414,111 +1004,113 @@ class Task(NodeWithTriggers):
         self.meters.remove(meter)
         meter.parent = None
 
-    def _node_from_path(self, path):
-        node = None
-        if path == self.path or path == '':
-            node = self
-        return node
-
-    def _specific_cdp_definition(self, indent_order=0):
-        output = ''
+    def _specific_cdp_definition(self, parts, indent_order=0):
         exp, nodes = self.trigger
         if exp != '':
-            trig = exp % tuple([n.path for n in nodes])
-            output += '%strigger %s\n' % ('\t' * indent_order, trig)
-        return output
+            trig = _trigger_definition(exp) % tuple([n.path for n in nodes])
+            parts.append('%strigger %s\n' % (_tabs(indent_order), trig))
 
 
 class Family(NodeWithTriggers):
 
-    families = []
-    tasks = []
-    limits = dict()
-    in_limits = []
+    __slots__ = ('_families', '_tasks', 'limits', 'in_limits')
 
     def __init__(self, parse_obj=None, parent=None, name=None):
         if parse_obj is None and name is None:
             raise Exception
-        super(Family, self).__init__(parse_obj=parse_obj, parent=parent)
+        self._families = _ChildList(self)
+        self._tasks = _ChildList(self)
+        self.limits = {}
+        self.in_limits = []
+        super().__init__(parse_obj=parse_obj, parent=parent)
         if parse_obj is None:
             self.name = name
-        else:
-            self.families = [Family(f, parent=self) for f in parse_obj if f[0] == 'family']
-            self.tasks = [Task(t, parent=self) for t in parse_obj if t[0] == 'task']
-            self._parse_limits(parse_obj)
-            self._parse_in_limits(parse_obj)
-            try:
-                self._trigger_exp = [t[1] for t in parse_obj if t[0] == 'trigger'][0]
-            except IndexError:
-                pass
 
-    def _parse_triggers(self):
-        self._parse_trigger()
-        for t in self.tasks:
-            t._parse_trigger()
-        for f in self.families:
-            f._parse_triggers()
+    @property
+    def families(self):
+        return self._families
+
+    @families.setter
+    def families(self, families):
+        self._families = _ChildList(self, families)
+        self._children = None
+        self._invalidate_path_index()
+
+    @property
+    def tasks(self):
+        return self._tasks
 
-    def _parse_limits(self, parse_obj):
-        self.limits = dict()
-        for lim in [lim for lim in parse_obj if lim[0] == 'limit']:
-            self.limits[lim[1]] = lim[2]
+    @tasks.setter
+    def tasks(self, tasks):
+        self._tasks = _ChildList(self, tasks)
+        self._children = None
+        self._invalidate_path_index()
+
+    @property
+    def _child_lists(self):
+        return (self._families, self._tasks)
+
+    def _parse_cdp(self, buckets):
+        self.families = [Family(f, parent=self) for f in buckets['family']]
+        self.tasks = [Task(t, parent=self) for t in buckets['task']]
+        self._parse_limits(buckets['limit'])
+        self._parse_in_limits(buckets['inlimit'])
+        if buckets['trigger']:
+            self._trigger_exp = buckets['trigger'][0][1]
+
+    def _parse_limits(self, limits):
+        self.limits = dict((lim[1], lim[2]) for lim in limits)
 
     # FIXME - untested
-    def _parse_in_limits(self, parse_obj):
+    def _parse_in_limits(self, in_limits):
         self.in_limits = []
-        for inlim in [il for il in parse_obj if il[0] == 'inlimit']:
+        for inlim in in_limits:
             node = self.get_node(inlim[1])
             limit = node.limits.get(inlim[2], None)
             self.in_limits.append((node, limit))
 
     # TODO:
     # - add trigger definition
-    def _specific_cdp_definition(self, indent_order=0):
-        output = ''
-        for n in self.tasks + self.families:
-            output += n.cdp_definition(indent_order)
-        return output
-
-    def _start_cdp_definition(self, indent_order=0):
-        output = ''
-        for name, num in self.limits.iteritems():
-            output += '%slimit %s %s\n' % ('\t'*(indent_order+1), name, num)
-        output += super(Family, self)._start_cdp_definition(indent_order)
-        return output
-
-    def _node_from_path(self, path):
-        if path == '' or path == '.':
-            node = self
-        else:
-            path_list = path.split('/')
-            node_list = self.tasks + self.families
-            possible_node = None
-            for n in node_list:
-                if n.name == path_list[0]:
-                    new_path = '/'.join(path_list[1:])
-                    possible_node = n._node_from_path(new_path)
-            node = possible_node
-        return node
+    def _specific_cdp_definition(self, parts, indent_order=0):
+        for n in itertools.chain(self.tasks, self.families):
+            n._cdp_definition(parts, indent_order)
+
+    def _start_cdp_definition(self, parts, indent_order=0):
+        pad = _tabs(indent_order+1)
+        for name, num in self.limits.items():
+            parts.append('%slimit %s %s\n' % (pad, name, num))
+        super()._start_cdp_definition(parts, indent_order)
+
+    def add_family(self, family):
+        if self._child_named(family.name) is not family:
+            old_parent = family.parent
+            if old_parent is not None and \
+                    old_parent._child_named(family.name) is family:
+                old_parent.remove_family(family)
+            self.families.append(family)
+            family.parent = self
+
+    def remove_family(self, family):
+        family._resolve_pending_triggers()
+        self.families.remove(family)
+        family.parent = None
 
     def add_task(self, task):
-        if task not in self.tasks:
+        if self._child_named(task.name) is not task:
             if task.parent is not None:
                 task.parent.remove_task(task)
             self.tasks.append(task)
             task.parent = self
 
     def remove_task(self, task):
+        task._resolve_pending_triggers()
         self.tasks.remove(task)
         task.parent = None
 
 
-class ExtraNode(object):
+class ExtraNode:
 
-    _name = ''
-    _parent = None
-    _path = ''
-    sms_type = None
+    __slots__ = ('_name', '_parent', '_path', 'sms_type')
 
     @property
     def name(self):
@@ -544,9 +1136,12 @@ class ExtraNode(object):
         return self._path
 
     def __init__(self, name, parent=None):
+        self._name = ''
+        self._parent = None
+        self._path = ''
         self.name = name
         self.parent = parent
-        self.sms_type = self.__class__.__name__.lower()
+        self.sms_type = sys.intern(self.__class__.__name__.lower())
 
     def __repr__(self):
         return self.name
@@ -555,9 +1150,7 @@ class ExtraNode(object):
 
 class Meter(ExtraNode):
 
-    _minimum = 0
-    _maximum = 100
-    _mark = 100
+    __slots__ = ('_minimum', '_maximum', '_mark')
 
     @property
     def minimum(self):
@@ -580,7 +1173,10 @@ class Meter(ExtraNode):
 
     def __init__(self, name, the_min=None, the_max=None, the_mark=None, 
                  parent=None):
-        super(Meter, self).__init__(name, parent)
+        super().__init__(name, parent)
+        self._minimum = 0
+        self._maximum = 100
+        self._mark = 100
         if the_min is not None:
             self._minimum = int(the_min)
         if the_max is not None:
@@ -591,12 +1187,58 @@ class Meter(ExtraNode):
 
 class Label(ExtraNode):
 
-    text = ''
+    __slots__ = ('text',)
 
     def __init__(self, name, text=None, parent=None):
-        super(Label, self).__init__(name, parent)
+        super().__init__(name, parent)
+        self.text = ''
         if text is not None:
             self.text = text
 
     def __repr__(self):
         return self.name
+
+
+def main(def_file, profile=False):
+    '''
+    Parse a definition file and return its suite's cdp definition.
+
+    Inputs:
+
+        def_file - path to the SMS definition file
+        profile - when True, profile the parsing and serialization with
+            cProfile and print the slowest calls to stderr
+    '''
+
+    if profile:
+        import cProfile
+        import pstats
+        profiler = cProfile.Profile()
+        profiler.enable()
+    suite = Suite(def_file)
+    result = suite.cdp_definition()
+    if profile:
+        profiler.disable()
+        stats = pstats.Stats(profiler, stream=sys.stderr)
+        stats.sort_stats('cumulative').print_stats(30)
+    return result
+
+
+_SERIALIZERS.update({
+    Task: _task_json,
+    Family: _family_json,
+    Suite: _suite_json,
+    Label: _label_json,
+    Meter: _meter_json,
+})
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Parse an SMS definition file and write it back out.')
+    parser.add_argument('def_file', help='SMS definition file')
+    parser.add_argument('--profile', action='store_true',
+                        help='print cProfile statistics to stderr')
+    args = parser.parse_args()
+    sys.stdout.write(main(args.def_file, profile=args.profile))
@@ -0,0 +1,325 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+
+'''
+Tests for the parser, the node tree and its serializations.
+'''
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import smsparser
+
+TEST_SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'test_suite.def')
+
+
+def _reparse(suite):
+    fd, def_file = tempfile.mkstemp(suffix='.def')
+    with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+        fh.write(suite.cdp_definition())
+    try:
+        return smsparser.Suite(def_file)
+    finally:
+        os.remove(def_file)
+
+
+class FastParseFileTestCase(unittest.TestCase):
+
+    def _write_def(self, contents):
+        fd, def_file = tempfile.mkstemp(suffix='.def')
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            fh.write(contents)
+        self.addCleanup(os.remove, def_file)
+        return def_file
+
+    def test_matches_grammar(self):
+        grammar = smsparser.sms_grammar()
+        expected = grammar.parse_file(TEST_SUITE, parse_all=True).as_list()
+        self.assertEqual(smsparser.fast_parse_file(TEST_SUITE), expected)
+
+    def test_only_grammar_whitespace_separates_tokens(self):
+        grammar = smsparser.sms_grammar()
+        for statement in ('edit\xa0a b', 'edit a "b\fc"', 'edit a\vb'):
+            def_file = self._write_def('suite s\n%s\nendsuite\n' % statement)
+            self.assertIsNone(smsparser.fast_parse_file(def_file))
+            self.assertRaises(Exception, grammar.parse_file, def_file,
+                              parse_all=True)
+        for statement in ('\tedit\ta\t"b\tc"', 'trigger\ta\t==\tcomplete',
+                          'trigger (a == complete)\t'):
+            def_file = self._write_def(
+                'suite s\nfamily f\ntask a\ntask b\n%s\nendfamily\n'
+                'endsuite\n' % statement)
+            expected = grammar.parse_file(def_file, parse_all=True).as_list()
+            self.assertEqual(smsparser.fast_parse_file(def_file), expected)
+
+
+class GetNodeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.suite = smsparser.Suite(TEST_SUITE)
+
+    def test_absolute_and_relative_paths(self):
+        dentro = self.suite.get_node('/main/subfam1/dentro')
+        self.assertEqual(dentro.path, '/main/subfam1/dentro')
+        self.assertIs(dentro.get_node('../outra'),
+                      self.suite.get_node('/main/outra'))
+        self.assertIsNone(self.suite.get_node('/main/missing'))
+
+    def test_direct_edits_of_the_child_lists(self):
+        main = self.suite.get_node('/main')
+        self.assertIs(self.suite.get_node('/main/outra').parent, main)
+        new = smsparser.Family(name='new', parent=self.suite)
+        self.suite.families.append(new)
+        self.assertIs(self.suite.get_node('/new'), new)
+        self.assertIs(main.get_node('new'), new)
+        outra = main.tasks[1]
+        del main.tasks[1]
+        self.assertIsNone(self.suite.get_node('/main/outra'))
+        main.tasks.insert(0, outra)
+        self.assertIs(self.suite.get_node('/main/outra'), outra)
+        self.suite.families.remove(main)
+        self.assertIsNone(self.suite.get_node('/main'))
+        self.assertIsNone(self.suite.get_node('/main/subfam1/dentro'))
+        self.suite.families = [main]
+        self.assertIs(self.suite.get_node('/main'), main)
+        self.assertIsNone(self.suite.get_node('/new'))
+
+    def test_add_and_remove_family(self):
+        main = self.suite.get_node('/main')
+        lag = self.suite.get_node('/lag')
+        main.add_family(lag)
+        self.assertEqual(lag.path, '/main/lag')
+        self.assertNotIn(lag, self.suite.families)
+        self.assertIs(self.suite.get_node('/main/lag/t4'), lag.tasks[0])
+        self.assertIsNone(self.suite.get_node('/lag'))
+        main.remove_family(lag)
+        self.assertIsNone(lag.parent)
+        self.assertIsNone(self.suite.get_node('/main/lag'))
+
+    def test_add_task(self):
+        main = self.suite.get_node('/main')
+        t4 = self.suite.get_node('/lag/t4')
+        main.add_task(t4)
+        main.add_task(t4)
+        self.assertEqual([t.name for t in main.tasks],
+                         ['teste', 'outra', 'maisuma', 't4'])
+        self.assertEqual(self.suite.get_node('/lag').tasks, [])
+        self.assertIs(self.suite.get_node('/main/t4'), t4)
+        main.remove_task(t4)
+        self.assertIsNone(self.suite.get_node('/main/t4'))
+
+    def test_filter_nodes(self):
+        self.assertEqual([n.path for n in self.suite.filter_nodes()], [
+            '/main', '/main/subfam1', '/main/subfam1/dentro', '/main/teste',
+            '/main/outra', '/main/maisuma', '/lag', '/lag/t4'])
+        self.assertEqual(
+            [n.path for n in self.suite.filter_nodes('task', '^(t|o)')],
+            ['/main/teste', '/main/outra', '/lag/t4'])
+        main = self.suite.get_node('/main')
+        self.assertEqual([n.path for n in main.filter_nodes(node_name='a')],
+                         ['/main/subfam1', '/main/outra', '/main/maisuma'])
+        self.assertEqual(self.suite.filter_nodes('suite'), [])
+
+    def test_rename_and_move_family(self):
+        main, lag = self.suite.get_node('/main'), self.suite.get_node('/lag')
+        teste = self.suite.get_node('/main/teste')
+        dentro = self.suite.get_node('/main/subfam1/dentro')
+        main.name = 'principal'
+        lag.add_family(main)
+        self.assertEqual(main.path, '/lag/principal')
+        self.assertIs(main.suite, self.suite)
+        self.assertEqual(dentro.path, '/lag/principal/subfam1/dentro')
+        self.assertEqual([l.path for l in teste.labels],
+                         ['/lag/principal/teste:information'])
+        self.assertEqual([m.path for m in teste.meters],
+                         ['/lag/principal/teste:progress'])
+        self.assertEqual([n.path for n in dentro.trigger[1]], [
+            '/lag/principal/outra', '/lag/principal/outra',
+            '/lag/principal/maisuma', '/lag/principal/maisuma'])
+        self.assertIsNone(self.suite.get_node('/main'))
+        self.assertIsNone(self.suite.get_node('/principal'))
+        self.assertIs(self.suite.get_node('/lag/principal'), main)
+        self.assertIs(self.suite.get_node('/lag/principal/teste'), teste)
+        self.assertIs(self.suite.get_node('/lag/principal/subfam1/dentro'),
+                      dentro)
+        self.assertIs(dentro.get_node('../outra'),
+                      self.suite.get_node('/lag/principal/outra'))
+
+
+class JsonTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.suite = smsparser.Suite(TEST_SUITE)
+
+    def test_node_types(self):
+        lag = json.loads(self.suite.get_node('/lag').to_json())
+        self.assertEqual(lag, {
+            'sms_type': 'family', 'name': 'lag',
+            'variables': {'host': 'geo2'},
+            'tasks': [{'sms_type': 'task', 'name': 't4',
+                       'variables': {'v1': '23'}, 'labels': [],
+                       'meters': []}],
+            'families': [],
+        })
+        teste = json.loads(self.suite.get_node('/main/teste').to_json())
+        self.assertEqual(teste['labels'], [
+            {'sms_type': 'label', 'name': 'information',
+             'text': 'nada de mais'}])
+        self.assertEqual(teste['meters'], [
+            {'sms_type': 'meter', 'name': 'progress', 'minimum': 0,
+             'maximum': 100, 'mark': 100}])
+        suite = json.loads(self.suite.to_json(indent=4))
+        self.assertEqual(sorted(suite), ['families', 'name', 'sms_type',
+                                         'variables'])
+        self.assertEqual(suite['sms_type'], 'suite')
+        self.assertEqual([f['name'] for f in suite['families']],
+                         ['main', 'lag'])
+        self.assertEqual(suite['families'][1], lag)
+        self.assertRaises(TypeError, smsparser.to_json, object())
+
+    def test_output_format(self):
+        self.suite.variables['nome'] = 'Jo\xe3o'
+        for indent in (None, 4):
+            self.assertEqual(
+                self.suite.to_json(indent=indent),
+                json.dumps(self.suite, default=smsparser.to_json,
+                           indent=indent))
+        expected = json.dumps(self.suite, default=smsparser.to_json,
+                              separators=(',', ':'), ensure_ascii=False)
+        self.assertEqual(self.suite.to_json(compact=True), expected)
+        with mock.patch.object(smsparser, 'orjson', None):
+            self.assertEqual(self.suite.to_json(indent=4, compact=True),
+                             expected)
+
+
+class TriggerTestCase(unittest.TestCase):
+
+    def test_split_trigger(self):
+        exp, paths = smsparser._split_trigger(
+            '(a == complete OR b != unknown) AND NOT ../c == complete')
+        self.assertEqual(paths, ['a', 'b', '../c'])
+        self.assertEqual(exp.split(), [
+            '(', '"%s"', '==', '"complete"', 'or', '"%s"', '!=', '"unknown"',
+            ')', 'and', 'not', '"%s"', '==', '"complete"'])
+
+    def test_split_trigger_rejects_unknown_characters(self):
+        for trigger in ('a ~= complete', 'a)b == complete', 'a < b'):
+            self.assertRaises(ValueError, smsparser._split_trigger, trigger)
+
+    def _suite(self, triggers):
+        contents = ['suite s', 'family f', 'task a', 'task b']
+        for i, trigger in enumerate(triggers):
+            contents += ['task t%i' % i, 'trigger %s' % trigger]
+        contents += ['endfamily', 'endsuite', '']
+        fd, def_file = tempfile.mkstemp(suffix='.def')
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            fh.write('\n'.join(contents))
+        self.addCleanup(os.remove, def_file)
+        return smsparser.Suite(def_file)
+
+    def test_evaluate_trigger(self):
+        suite = self._suite([
+            'a == complete AND b == complete',
+            'a == complete OR b == complete',
+            'NOT a == complete',
+            '(a != unknown AND b == unknown) OR /f/b == complete',
+        ])
+        a, b = suite.get_node('/f/a'), suite.get_node('/f/b')
+        tasks = [suite.get_node('/f/t%i' % i) for i in range(4)]
+        cases = [
+            (('unknown', 'unknown'), [False, False, True, False]),
+            (('complete', 'unknown'), [False, True, False, True]),
+            (('complete', 'complete'), [True, True, False, True]),
+            (('unknown', 'complete'), [False, True, True, True]),
+        ]
+        for (a.status, b.status), expected in cases:
+            self.assertEqual([t.evaluate_trigger() for t in tasks], expected)
+        self.assertTrue(suite.get_node('/f/a').evaluate_trigger())
+
+    def test_trigger_function_cache(self):
+        template = smsparser._split_trigger('x == complete AND y == unknown')[0]
+        smsparser._TRIGGER_FUNCTIONS.pop(template, None)
+        suite = self._suite(['a == complete AND b == unknown',
+                             'b == complete AND a == unknown'])
+        t0, t1 = suite.get_node('/f/t0'), suite.get_node('/f/t1')
+        self.assertNotIn(template, smsparser._TRIGGER_FUNCTIONS)
+        suite.get_node('/f/a').status = 'complete'
+        self.assertTrue(t0.evaluate_trigger())
+        function = smsparser._TRIGGER_FUNCTIONS[template]
+        self.assertFalse(t1.evaluate_trigger())
+        self.assertIs(smsparser._TRIGGER_FUNCTIONS[template], function)
+        self.assertIs(smsparser._trigger_function(t1.trigger[0]), function)
+
+    def test_cdp_definition_round_trip(self):
+        suite = self._suite(['(a == complete OR b != unknown) AND NOT '
+                             '../f/b == complete'])
+        definition = suite.cdp_definition()
+        self.assertIn('\t\t\ttrigger (/f/a == complete OR /f/b != unknown) '
+                      'AND NOT /f/b == complete\n', definition)
+        self.assertEqual(_reparse(suite).cdp_definition(), definition)
+        self.assertEqual(smsparser.Suite(TEST_SUITE).cdp_definition(),
+                         _reparse(smsparser.Suite(TEST_SUITE)).cdp_definition())
+
+    def _trigger_paths(self, node):
+        return [n.path for n in node.trigger[1]]
+
+    def test_rename_before_trigger_is_resolved(self):
+        suite = smsparser.Suite(TEST_SUITE)
+        suite.get_node('/main').name = 'principal'
+        dentro = suite.get_node('/principal/subfam1/dentro')
+        self.assertEqual(self._trigger_paths(dentro), [
+            '/principal/outra', '/principal/outra', '/principal/maisuma',
+            '/principal/maisuma'])
+        self.assertIn('trigger ((/principal/outra == complete OR '
+                      '/principal/outra == unknown) AND '
+                      '(/principal/maisuma == complete OR '
+                      '/principal/maisuma == unknown))\n',
+                      suite.cdp_definition())
+
+    def test_move_before_trigger_is_resolved(self):
+        suite = smsparser.Suite(TEST_SUITE)
+        main, lag = suite.get_node('/main'), suite.get_node('/lag')
+        subfam1 = suite.get_node('/main/subfam1')
+        outra = suite.get_node('/main/outra')
+        main.remove_task(outra)
+        lag.add_task(outra)
+        lag.add_family(subfam1)
+        dentro = suite.get_node('/lag/subfam1/dentro')
+        self.assertIs(dentro.trigger[1][0], outra)
+        self.assertEqual(self._trigger_paths(dentro), [
+            '/lag/outra', '/lag/outra', '/main/maisuma', '/main/maisuma'])
+        self.assertIn('trigger ((/lag/outra == complete OR '
+                      '/lag/outra == unknown) AND '
+                      '(/main/maisuma == complete OR '
+                      '/main/maisuma == unknown))\n',
+                      suite.cdp_definition())
+
+
+class MainTestCase(unittest.TestCase):
+
+    def test_main(self):
+        expected = smsparser.Suite(TEST_SUITE).cdp_definition()
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.assertEqual(smsparser.main(TEST_SUITE), expected)
+        self.assertEqual(stderr.getvalue(), '')
+
+    def test_main_with_profile(self):
+        expected = smsparser.Suite(TEST_SUITE).cdp_definition()
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            result = smsparser.main(TEST_SUITE, profile=True)
+        self.assertEqual(result, expected)
+        self.assertIn('function calls', stderr.getvalue())
+        self.assertIn('cumulative', stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()